@@ -1,39 +1,80 @@
 import argparse
 import json
+import numpy as np
 import torch
 import sys
 import os
 import hydra
 from omegaconf import OmegaConf
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 # Add project root
-sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if REPO_ROOT not in sys.path:
+    sys.path.append(REPO_ROOT)
 
 from src.metrics import plddt, esmpppl, fid
 from src.utils.hydra_utils import setup_config
 
-def calculate_metrics(generated_sequences, config, device, metrics_list):
+def load_sequences(json_path):
+    """Load the generated sequences json, with the orjson parser when it is installed."""
+    with open(json_path, "rb") as f:
+        data = f.read()
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def summarize(name, values):
+    """Print mean, median and 95th percentile of per-sequence metric values."""
+    if not values:
+        print(f"{name}: no values")
+        return
+    arr = np.fromiter(values, dtype=np.float64, count=len(values))
+    mean, p50, p95 = float(arr.mean()), float(np.median(arr)), float(np.quantile(arr, 0.95))
+    print(f"{name}: mean={mean:.4f} p50={p50:.4f} p95={p95:.4f}")
+
+def deduplicate(sequences):
+    """Return unique sequences (in first-seen order) and the index of each input sequence among them."""
+    positions = {}
+    inverse = [positions.setdefault(seq, len(positions)) for seq in sequences]
+    return list(positions), inverse
+
+def calculate_metrics(generated_sequences, config, device, metrics_list, int8=False, cuda_graphs=False, plddt_batch_size=1):
     results = {}
+
+    # Both metrics are deterministic per sequence, so score every distinct sequence once
+    unique_sequences, inverse = deduplicate(generated_sequences)
+    if len(unique_sequences) < len(generated_sequences):
+        print(f"Scoring {len(unique_sequences)} unique out of {len(generated_sequences)} sequences")
     
     if "esmpppl" in metrics_list:
         print("Calculating ESM Perplexity...")
         # Fix: use calculate_pppl, assume max_len=512 for now or based on config
         # We need to know max_len or just pick large enough
-        val = esmpppl.calculate_pppl(generated_sequences, max_len=512, device=device)
+        unique_val = esmpppl.calculate_pppl(unique_sequences, max_len=512, device=device, int8=int8, cuda_graphs=cuda_graphs)
+        val = [unique_val[i] for i in inverse]
         results["esmpppl"] = val
-        print(f"ESM PPPL (mean): {sum(val)/len(val) if val else 0}")
+        summarize("ESM PPPL", val)
 
     if "plddt" in metrics_list:
         print("Calculating pLDDT (requires ESMFold)...")
         # Fix: use calculate_plddt w/ index_list
         pdb_path = "auto-scripts/generated_pdbs"
         os.makedirs(pdb_path, exist_ok=True)
-        indices = list(range(len(generated_sequences)))
-        val_dict = plddt.calculate_plddt(generated_sequences, index_list=indices, device=device, pdb_path=pdb_path)
-        # Convert dict to list of values or keep dict
-        val = list(val_dict.values())
+        # PDB files are named after positions in the generated samples, so use each unique sequence's first one
+        first_index = {seq: i for i, seq in reversed(list(enumerate(generated_sequences)))}
+        indices = [first_index[seq] for seq in unique_sequences]
+        val_dict = plddt.calculate_plddt(
+            unique_sequences, index_list=indices, device=device, pdb_path=pdb_path, int8=int8, batch_size=plddt_batch_size
+        )
+        # val_dict is keyed by sequence; expand back to one value per generated sequence
+        val = [val_dict[seq] for seq in generated_sequences]
         results["plddt"] = val
-        print(f"pLDDT (mean): {sum(val)/len(val) if val else 0}")
+        summarize("pLDDT", val)
 
     return results
 
@@ -42,20 +83,26 @@ if __name__ == "__main__":
     parser.add_argument("--json_path", type=str, required=True, help="Path to generated json")
     parser.add_argument("--metrics", nargs="+", default=["esmpppl", "plddt"], help="Metrics to calc")
     parser.add_argument("--config_path", type=str, default="src/configs/config.yaml")
+    parser.add_argument("--int8", action="store_true", help="Score with INT8-quantized ESM models on CPU")
+    parser.add_argument("--cuda-graphs", action="store_true", help="Replay a CUDA graph for the ESM-PPPL masked forwards")
+    parser.add_argument("--plddt-batch-size", type=int, default=1, help="Sequences folded per ESMFold forward for pLDDT")
+    parser.add_argument("--pretty", action="store_true", help="Indent the metrics json")
     args = parser.parse_args()
 
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    device = torch.device("cuda" if torch.cuda.is_available() and not args.int8 else "cpu")
     
-    with open(args.json_path, "r") as f:
-        sequences = json.load(f)
+    sequences = load_sequences(args.json_path)
         
     # config needed? maybe for some paths
     config = setup_config(config_path=args.config_path)
     
-    results = calculate_metrics(sequences, config, device, args.metrics)
+    results = calculate_metrics(
+        sequences, config, device, args.metrics,
+        int8=args.int8, cuda_graphs=args.cuda_graphs, plddt_batch_size=args.plddt_batch_size,
+    )
     
     # Save results
     output_path = args.json_path.replace(".json", "_metrics.json")
     with open(output_path, "w") as f:
-        json.dump(results, f, indent=4)
+        f.write(json.dumps(results, indent=4 if args.pretty else None))
     print(f"Metrics saved to {output_path}")
@@ -1,10 +1,15 @@
 import os
 import argparse
+import hashlib
 import sys
+import numpy as np
+import pyarrow.compute as pc
 from datasets import load_from_disk, load_dataset, Dataset
 
 # Add project root to path to allow imports from src
-sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if REPO_ROOT not in sys.path:
+    sys.path.append(REPO_ROOT)
 
 from src.utils.hydra_utils import setup_config
 from src.datasets.load_hub import load_from_hub
@@ -12,7 +17,40 @@ from src.datasets.load_hub import load_from_hub
 def filter_by_length(dataset, min_len, max_len):
     """Filter dataset by sequence length."""
     print(f"Filtering dataset: keeping sequences between {min_len} and {max_len}...")
-    return dataset.filter(lambda x: min_len <= len(x["sequence"]) <= max_len)
+    # Compute lengths on the Arrow column directly instead of calling a Python lambda per row
+    lengths = pc.utf8_length(dataset.with_format("arrow")["sequence"])
+    mask = pc.and_(pc.greater_equal(lengths, min_len), pc.less_equal(lengths, max_len))
+    indices = pc.indices_nonzero(mask).to_numpy()
+    return dataset.select(indices)
+
+FINGERPRINT_FILE = "prepare_fingerprint.txt"
+
+def get_fingerprint(*params):
+    """Short hash of the preparation parameters."""
+    return hashlib.sha1("|".join(map(str, params)).encode()).hexdigest()[:12]
+
+def is_prepared(split_paths, fingerprint):
+    """Check that every split was saved with the same preparation parameters."""
+    for path in split_paths:
+        try:
+            with open(os.path.join(path, FINGERPRINT_FILE), "r") as f:
+                if f.read().strip() != fingerprint:
+                    return False
+        except FileNotFoundError:
+            return False
+    return True
+
+def get_num_proc():
+    """Number of CPUs this process may run on (respects affinity masks, e.g. under SLURM or taskset)."""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+def save_split(data, path, fingerprint, num_shards=None, num_proc=None):
+    """Save a split and mark it with the fingerprint it was prepared with."""
+    data.save_to_disk(path, num_shards=num_shards, num_proc=num_proc)
+    with open(os.path.join(path, FINGERPRINT_FILE), "w") as f:
+        f.write(fingerprint)
 
 def prepare_afdb(config, output_dir):
     """Download and prepare AFDB dataset."""
@@ -20,56 +58,64 @@ def prepare_afdb(config, output_dir):
     # Using the dataset logic from load_hub.py but adapted for this script
     group_name = "bayes-group-diffusion"
     dataset_name = "AFDB-v2"
-    
+    min_len, max_len = 64, 510
+    test_size = 50000
+    val_size = 50000
+    seed = 42
+
+    # Skip preparation if the splits were already produced with the same parameters
+    fingerprint = get_fingerprint(dataset_name, min_len, max_len, test_size, val_size, seed)
+    split_paths = {name: os.path.join(output_dir, name) for name in ["train", "val", "test"]}
+    if is_prepared(split_paths.values(), fingerprint):
+        print(f"AFDB splits already prepared in {output_dir} (fingerprint {fingerprint}), skipping.")
+        return
+
     # We load from hub, but we might want to cache it locally in a raw folder first
     raw_path = os.path.join(config.datasets.data_dir, "raw", dataset_name)
     if not os.path.exists(raw_path):
         print(f"Downloading {dataset_name} to {raw_path}...")
-        dataset = load_dataset(f"{group_name}/{dataset_name}")
+        # Download and convert the hub shards in parallel
+        dataset = load_dataset(f"{group_name}/{dataset_name}", num_proc=get_num_proc(), keep_in_memory=False)
         # Assuming it's a DatasetDict or we take 'train' split if it's the only one
         # But load_dataset usually returns DatasetDict if splits exist
         dataset.save_to_disk(raw_path)
     else:
         print(f"Loading raw {dataset_name} from {raw_path}...")
-        dataset = load_from_disk(raw_path)
+        dataset = load_from_disk(raw_path, keep_in_memory=False)
 
     # If dataset is a dict, iterate? Usually unconditional training uses one big train set.
     # checking src/datasets/load_hub.py, it seems it expects a single disk save.
     
-    if hasattr(dataset, "keys") and "train" in dataset.keys():
+    if hasattr(dataset, "keys") and "train" in dataset:
         full_data = dataset["train"]
     else:
         full_data = dataset
 
     # Filter
-    filtered_data = filter_by_length(full_data, 64, 510)
+    filtered_data = filter_by_length(full_data, min_len, max_len)
     
     # Split: 2.1M train / 50K val / 50K test (approx)
     # Total size check
     total_size = len(filtered_data)
     print(f"Total sequences after filtering: {total_size}")
     
-    test_size = 50000
-    val_size = 50000
     train_size = total_size - test_size - val_size
     
     if train_size <= 0:
          raise ValueError("Dataset too small for requested split sizes.")
 
-    # Deterministic split
-    split_1 = filtered_data.train_test_split(test_size=test_size, seed=42)
-    test_data = split_1["test"]
-    remaining = split_1["train"]
-    
-    split_2 = remaining.train_test_split(test_size=val_size, seed=42)
-    val_data = split_2["test"]
-    train_data = split_2["train"]
+    # Deterministic split: a single permutation gathered into three index selections
+    rng = np.random.default_rng(seed)
+    permutation = rng.permutation(total_size)
+    test_data = filtered_data.select(permutation[:test_size])
+    val_data = filtered_data.select(permutation[test_size:test_size + val_size])
+    train_data = filtered_data.select(permutation[test_size + val_size:])
     
     # Save
     print(f"Saving splits to {output_dir}...")
-    train_data.save_to_disk(os.path.join(output_dir, "train"))
-    val_data.save_to_disk(os.path.join(output_dir, "val"))
-    test_data.save_to_disk(os.path.join(output_dir, "test"))
+    save_split(train_data, split_paths["train"], fingerprint, num_proc=get_num_proc())
+    save_split(val_data, split_paths["val"], fingerprint)
+    save_split(test_data, split_paths["test"], fingerprint)
     
     print("AFDB preparation complete.")
 
@@ -78,27 +124,34 @@ def prepare_swissprot(config, output_dir):
     print("Preparing SwissProt dataset...")
     group_name = "bayes-group-diffusion"
     dataset_name = "swissprot"
+    min_len, max_len = 128, 254
+
+    save_path = os.path.join(output_dir, "swissprot_val")
+    fingerprint = get_fingerprint(dataset_name, min_len, max_len)
+    if is_prepared([save_path], fingerprint):
+        print(f"SwissProt already prepared in {save_path} (fingerprint {fingerprint}), skipping.")
+        return
     
     raw_path = os.path.join(config.datasets.data_dir, "raw", dataset_name)
     if not os.path.exists(raw_path):
         print(f"Downloading {dataset_name} to {raw_path}...")
-        dataset = load_dataset(f"{group_name}/{dataset_name}")
+        # Download and convert the hub shards in parallel
+        dataset = load_dataset(f"{group_name}/{dataset_name}", num_proc=get_num_proc(), keep_in_memory=False)
         dataset.save_to_disk(raw_path)
     else:
-        dataset = load_from_disk(raw_path)
+        dataset = load_from_disk(raw_path, keep_in_memory=False)
 
-    if hasattr(dataset, "keys") and "train" in dataset.keys():
+    if hasattr(dataset, "keys") and "train" in dataset:
         data = dataset["train"]
     else:
         data = dataset
 
     # Filter 128-254
-    filtered_data = filter_by_length(data, 128, 254)
+    filtered_data = filter_by_length(data, min_len, max_len)
     print(f"SwissProt sequences after filtering: {len(filtered_data)}")
     
-    # Save as specific validation set
-    save_path = os.path.join(output_dir, "swissprot_val")
-    filtered_data.save_to_disk(save_path)
+    # Save as specific validation set, sharded so dataloader workers can read shards independently
+    save_split(filtered_data, save_path, fingerprint, num_shards=min(16, get_num_proc()))
     print(f"Saved SwissProt to {save_path}")
 
 if __name__ == "__main__":
@@ -2,17 +2,56 @@ import hydra
 import torch
 import os
 import json
+from hydra import compose, initialize
 from src.diffusion.base_trainer import BaseDiffusionTrainer
 from src.utils import seed_everything, setup_ddp, print_config
 from omegaconf import OmegaConf
 
-@hydra.main(version_base=None, config_path="../src/configs", config_name="config")
-def main(config):
+# Trainers built by run(), keyed by the resolved config, so repeated in-process runs
+# (e.g. via run_from_overrides) skip model initialization and checkpoint loading
+_TRAINER_CACHE = {}
+# Sections that run() applies per call (trainer.config is replaced) and that never shape the trainer
+_PER_RUN_CONFIG_KEYS = ["generation", "pretty_json"]
+
+def clear_trainer_cache():
+    _TRAINER_CACHE.clear()
+
+def get_trainer(config, device):
+    checkpoint_path = OmegaConf.select(config, "checkpoint_path", default=None)
+    trainer_config = {
+        k: v for k, v in OmegaConf.to_container(config, resolve=True).items() if k not in _PER_RUN_CONFIG_KEYS
+    }
+    key = (str(device), json.dumps(trainer_config, sort_keys=True, default=str))
+    if key in _TRAINER_CACHE:
+        print("Reusing loaded trainer...")
+        return _TRAINER_CACHE[key]
+
+    print("Initializing trainer...")
+    trainer = BaseDiffusionTrainer(config, device)
+    
+    # Load checkpoint if provided
+    # pass 'checkpoint_path' via command line override or config
+    # e.g. ++checkpoint_path=/path/to/ckpt.pth
+    if checkpoint_path:
+        print(f"Loading checkpoint from {checkpoint_path}...")
+        trainer.restore_checkpoint(checkpoint_path)
+    elif config.training.init_se:
+         print(f"Loading init_se from {config.training.init_se}...")
+         trainer.init_checkpoint()
+    
+    trainer.ddp_score_estimator.eval()
+    if hasattr(trainer, "switch_to_ema"):
+        trainer.switch_to_ema()
+
+    _TRAINER_CACHE[key] = trainer
+    return trainer
+
+def run(config):
     # Disable DDP for simple inference script if running on single GPU/cpu for testing
     # But code expects ddp config
     
     # Adjust config for inference
-    if not hasattr(config.ddp, "enabled"):
+    if OmegaConf.select(config, "ddp.enabled") is None:
          config.ddp.enabled = False
     
     config.ddp.global_rank = 0
@@ -26,30 +65,30 @@ def main(config):
 
     seed_everything(config.project.seed)
     
-    print("Initializing trainer...")
-    trainer = BaseDiffusionTrainer(config, device)
-    
-    # Load checkpoint if provided
-    # pass 'checkpoint_path' via command line override or config
-    # e.g. ++checkpoint_path=/path/to/ckpt.pth
-    if hasattr(config, "checkpoint_path") and config.checkpoint_path:
-        print(f"Loading checkpoint from {config.checkpoint_path}...")
-        trainer.restore_checkpoint(config.checkpoint_path)
-    elif config.training.init_se:
-         print(f"Loading init_se from {config.training.init_se}...")
-         trainer.init_checkpoint()
+    trainer = get_trainer(config, device)
+    # A cached trainer may have been built with different generation settings
+    trainer.config = config
     
     print(f"Generating {config.generation.num_gen_samples} samples...")
-    trainer.ddp_score_estimator.eval()
-    if hasattr(trainer, "switch_to_ema"):
-        trainer.switch_to_ema()
-        
     sequences = trainer.generate_samples(config.generation.num_gen_samples)
     
     output_path = os.path.join("auto-scripts", "generated_samples.json")
+    # json.dumps without indent encodes in C in one shot; pass ++pretty_json=true for indented output
+    indent = 4 if OmegaConf.select(config, "pretty_json", default=False) else None
     with open(output_path, "w") as f:
-        json.dump(sequences, f, indent=4)
+        f.write(json.dumps(sequences, indent=indent))
     print(f"Saved generated sequences to {output_path}")
+    return sequences
+
+def run_from_overrides(overrides=None):
+    """Compose the config in-process (no hydra.main argv parsing or chdir) and run inference."""
+    with initialize(version_base=None, config_path="../src/configs"):
+        config = compose(config_name="config", overrides=overrides or [])
+    return run(config)
+
+@hydra.main(version_base=None, config_path="../src/configs", config_name="config")
+def main(config):
+    return run(config)
 
 if __name__ == "__main__":
     main()
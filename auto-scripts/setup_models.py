@@ -1,12 +1,12 @@
-import torch
-from transformers import EsmForMaskedLM, EsmTokenizer, AutoModel, AutoTokenizer
-from cheap.pretrained import load_pretrained_model, CHECKPOINT_DIR_PATH
 import os
 import argparse
+import importlib.util
+from concurrent.futures import ProcessPoolExecutor
 
 def setup_esm2(model_name="facebook/esm2_t36_3B_UR50D"):
     print(f"Setting up ESM2: {model_name}...")
     try:
+        from transformers import EsmForMaskedLM, EsmTokenizer
         EsmTokenizer.from_pretrained(model_name)
         EsmForMaskedLM.from_pretrained(model_name)
         print("ESM2 setup complete.")
@@ -16,8 +16,10 @@ def setup_esm2(model_name="facebook/esm2_t36_3B_UR50D"):
 def setup_saprot(model_name="westlake-repl/SaProt_35M_AF2"):
     print(f"Setting up SaProt: {model_name}...")
     try:
+        from transformers import AutoModel, AutoTokenizer
         AutoTokenizer.from_pretrained(model_name)
-        AutoModel.from_pretrained(model_name, trust_remote_code=True)
+        # SaProt checkpoints use the stock ESM architecture, so no remote modeling code is needed
+        AutoModel.from_pretrained(model_name, add_cross_attention=False, is_decoder=False)
         print("SaProt setup complete.")
     except Exception as e:
         print(f"Error setting up SaProt: {e}")
@@ -27,6 +29,8 @@ def setup_cheap():
     # Based on src/encoders/cheap.py, it uses load_pretrained_model
     # We'll try to trigger a download if possible, or just verify it runs
     try:
+        from cheap.pretrained import load_pretrained_model, CHECKPOINT_DIR_PATH
+
         # These params match what's in cheap.yaml
         shorten_factor = 1
         channel_dimension = 1024
@@ -45,11 +49,19 @@ if __name__ == "__main__":
     parser.add_argument("--models", nargs="+", default=["esm2", "saprot", "cheap"], help="Models to setup")
     args = parser.parse_args()
 
-    if "esm2" in args.models:
-        setup_esm2()
-    
-    if "saprot" in args.models:
-        setup_saprot()
-        
-    if "cheap" in args.models:
-        setup_cheap()
+    # Use the multi-connection Rust downloader when it is installed
+    if importlib.util.find_spec("hf_transfer") is not None:
+        os.environ.setdefault("HF_HUB_ENABLE_HF_TRANSFER", "1")
+
+    setup_fns = {
+        "esm2": setup_esm2,
+        "saprot": setup_saprot,
+        "cheap": setup_cheap,
+    }
+    selected = [setup_fns[name] for name in args.models if name in setup_fns]
+
+    # Downloads and checkpoint reads are network/disk bound, so run them in parallel processes
+    with ProcessPoolExecutor(max_workers=max(len(selected), 1)) as executor:
+        futures = [executor.submit(fn) for fn in selected]
+        for future in futures:
+            future.result()
@@ -1,28 +1,114 @@
 import unittest
-from unittest.mock import MagicMock, patch
+from unittest.mock import MagicMock, mock_open, patch
+import importlib.util
+import contextlib
+import tempfile
 import sys
 import os
 import argparse
 
+# Real torch / numpy are needed for the numerical tests; import them before setUpClass can mock them
+HAS_TORCH = importlib.util.find_spec("torch") is not None
+HAS_NUMPY = importlib.util.find_spec("numpy") is not None
+if HAS_NUMPY:
+    import numpy as np
+if HAS_TORCH:
+    import torch
+
 # Add path
-sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
-sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(os.path.dirname(TESTS_DIR))
+for path in (REPO_ROOT, os.path.dirname(TESTS_DIR)):
+    if path not in sys.path:
+        sys.path.append(path)
+
+# Modules that might be missing; each gets its own mock so patched attributes stay independent
+MOCKED_MODULES = (
+    "torch", "hydra", "datasets", "pyarrow", "pyarrow.compute", "transformers", "cheap", "cheap.pretrained",
+    "omegaconf", "biotite", "biotite.structure.io",
+    "src.metrics.plddt", "src.metrics.esmpppl", "src.metrics.fid",
+    "src.utils.hydra_utils", "src.datasets.load_hub", "src.diffusion.base_trainer",
+    "src.utils", "numpy", "src.metrics.metric"
+)
+
+def load_repo_module(relative_path, stubs):
+    """Execute a repo source file as a fresh module, with `stubs` temporarily installed in sys.modules."""
+    name = "_under_test_" + os.path.splitext(os.path.basename(relative_path))[0]
+    spec = importlib.util.spec_from_file_location(name, os.path.join(REPO_ROOT, relative_path))
+    module = importlib.util.module_from_spec(spec)
+    with patch.dict(sys.modules, stubs):
+        spec.loader.exec_module(module)
+    return module
+
+
+@contextlib.contextmanager
+def unmocked_modules():
+    """Temporarily drop the MagicMock stand-ins from sys.modules so the real packages get imported."""
+    with patch.dict(sys.modules):
+        for name in [name for name, module in sys.modules.items() if isinstance(module, MagicMock)]:
+            del sys.modules[name]
+        yield
+
+
+class FakeFolder:
+    """Stands in for ESMFold: returns one PDB text per sequence and records the batches it folds."""
+    def __init__(self):
+        self.batches = []
+
+    def eval(self):
+        return self
+
+    def to(self, device):
+        return self
+
+    def infer_pdbs(self, proteins):
+        self.batches.append(list(proteins))
+        return [f"PDB {protein}" for protein in proteins]
+
+
+def fake_pdb_read(handle):
+    """Parse a FakeFolder PDB text into a structure whose pLDDT depends only on the sequence."""
+    text = handle.read()
+    pdb_file = MagicMock()
+    pdb_file.get_structure.return_value.b_factor.mean.return_value = 10.0 * len(text) + sum(map(ord, text)) % 7
+    return pdb_file
+
+
+def plddt_stubs(folder, torch_module=None, util_module=None):
+    if torch_module is None:
+        torch_module = MagicMock()
+        torch_module.no_grad.return_value = lambda fn: fn
+    biotite = MagicMock()
+    biotite.structure.io.pdb.PDBFile.read.side_effect = fake_pdb_read
+    tqdm_stub = MagicMock()
+    tqdm_stub.tqdm = lambda iterable: iterable
+    cheap_esmfold = MagicMock()
+    cheap_esmfold.esmfold_v1.return_value = folder
+    return {
+        "torch": torch_module, "tqdm": tqdm_stub, "cheap": MagicMock(), "cheap.esmfold": cheap_esmfold,
+        "biotite": biotite, "biotite.structure": biotite.structure, "biotite.structure.io": biotite.structure.io,
+        "biotite.structure.io.pdb": biotite.structure.io.pdb, "src.metrics.util": util_module or MagicMock(),
+    }
+
+
+def tiny_fp16_lm():
+    """A half-precision token model standing in for the ESM-2 language model."""
+    return torch.nn.Sequential(torch.nn.Embedding(10, 8), torch.nn.Linear(8, 8)).half()
+
+
+def load_real_metrics_util(lm):
+    transformers_stub = MagicMock()
+    transformers_stub.EsmForMaskedLM.from_pretrained.return_value = lm
+    return load_repo_module(
+        os.path.join("src", "metrics", "util.py"), {"torch": torch, "transformers": transformers_stub, "tqdm": MagicMock()}
+    )
+
 
 class TestAutoScripts(unittest.TestCase):
 
     @classmethod
     def setUpClass(cls):
-        # Mock modules that might be missing
-        modules_to_mock = [
-            "torch", "hydra", "datasets", "transformers", "cheap", "cheap.pretrained", 
-            "omegaconf", "biotite", "biotite.structure.io", 
-            "src.metrics.plddt", "src.metrics.esmpppl", "src.metrics.fid", 
-            "src.utils.hydra_utils", "src.datasets.load_hub", "src.diffusion.base_trainer",
-            "src.utils", "numpy", "src.metrics.metric"
-        ]
-        for mod in modules_to_mock:
-            if mod not in sys.modules:
-                sys.modules[mod] = MagicMock()
+        sys.modules.update({mod: MagicMock() for mod in MOCKED_MODULES if mod not in sys.modules})
 
     def test_prepare_data_imports(self):
         """Test that we can import prepare_data and it has expected functions."""
@@ -46,43 +132,229 @@ class TestAutoScripts(unittest.TestCase):
     def test_run_inference_mock(self, mock_hydra, mock_trainer):
         """Test run_inference logic with mocks."""
         import run_inference
-        
+
         # Mock config
         mock_config = MagicMock()
         mock_config.ddp.enabled = False
         mock_config.generation.num_gen_samples = 2
-        
+
         # Mock trainer instance
         mock_trainer_instance = mock_trainer.return_value
         mock_trainer_instance.generate_samples.return_value = ["SEQ1", "SEQ2"]
-        
+
         # Run main logic (extract body of main since hydra decorates it)
-        # We can't easily run the decorated function without hydra context, 
+        # We can't easily run the decorated function without hydra context,
         # so we'll just check if we can instantiate everything.
-        
+
         trainer = run_inference.BaseDiffusionTrainer(mock_config, "cpu")
         seqs = trainer.generate_samples(2)
         self.assertEqual(seqs, ["SEQ1", "SEQ2"])
 
+    @patch("builtins.open", new_callable=mock_open)
+    @patch("run_inference.BaseDiffusionTrainer")
+    def test_run_inference_run(self, mock_trainer, mock_file):
+        """Test run_inference.run without the hydra.main wrapper."""
+        import run_inference
+
+        mock_config = MagicMock()
+        mock_config.generation.num_gen_samples = 2
+        mock_trainer.return_value.generate_samples.return_value = ["SEQ1", "SEQ2"]
+
+        run_inference.clear_trainer_cache()
+        seqs = run_inference.run(mock_config)
+
+        self.assertEqual(seqs, ["SEQ1", "SEQ2"])
+        mock_trainer.return_value.generate_samples.assert_called_once_with(2)
+        mock_file.assert_called_once_with(os.path.join("auto-scripts", "generated_samples.json"), "w")
+
+        # A second run with the same model config reuses the trainer
+        run_inference.run(mock_config)
+        mock_trainer.assert_called_once()
+        run_inference.clear_trainer_cache()
+
+    @patch("builtins.open", new_callable=mock_open)
+    @patch("run_inference.BaseDiffusionTrainer")
+    def test_run_inference_cache_key(self, mock_trainer, mock_file):
+        """Test that only per-run sections (generation) can share a cached trainer."""
+        import run_inference
+
+        mock_config = MagicMock()
+        mock_config.generation.num_gen_samples = 2
+        mock_trainer.return_value.generate_samples.return_value = ["SEQ1", "SEQ2"]
+        resolved = [
+            {"model": {"size": 1}, "project": {"seed": 0}, "ddp": {"enabled": False}, "generation": {"N_steps": 10}},
+            {"model": {"size": 1}, "project": {"seed": 0}, "ddp": {"enabled": False}, "generation": {"N_steps": 20}},
+            {"model": {"size": 1}, "project": {"seed": 1}, "ddp": {"enabled": False}, "generation": {"N_steps": 20}},
+            {"model": {"size": 1}, "project": {"seed": 1}, "ddp": {"enabled": True}, "generation": {"N_steps": 20}},
+        ]
+
+        run_inference.clear_trainer_cache()
+        with patch("run_inference.OmegaConf.to_container", side_effect=resolved):
+            for _ in resolved:
+                run_inference.run(mock_config)
+        run_inference.clear_trainer_cache()
+
+        # generation differs only in the second run; project and ddp changes rebuild the trainer
+        self.assertEqual(mock_trainer.call_count, 3)
+
     @patch("calc_metrics.esmpppl.calculate_pppl")
     @patch("calc_metrics.plddt.calculate_plddt")
     def test_calc_metrics_mock(self, mock_plddt, mock_pppl):
         """Test calc_metrics logic."""
         import calc_metrics
-        
+
         mock_pppl.return_value = [10.0, 12.0]
         mock_plddt.return_value = {"SEQ1": 0.8, "SEQ2": 0.9}
-        
+
         seqs = ["SEQ1", "SEQ2"]
         # Mock config
         config = MagicMock()
-        
+
         results = calc_metrics.calculate_metrics(seqs, config, "cpu", ["esmpppl", "plddt"])
-        
+
         self.assertIn("esmpppl", results)
         self.assertIn("plddt", results)
         self.assertEqual(results["esmpppl"], [10.0, 12.0])
         self.assertEqual(results["plddt"], [0.8, 0.9])
 
+    @patch("calc_metrics.esmpppl.calculate_pppl")
+    @patch("calc_metrics.plddt.calculate_plddt")
+    def test_calc_metrics_deduplicates(self, mock_plddt, mock_pppl):
+        """Test that duplicate sequences are scored once and expanded back in order."""
+        import calc_metrics
+
+        mock_pppl.return_value = [10.0, 12.0]
+        mock_plddt.return_value = {"SEQ1": 0.8, "SEQ2": 0.9}
+
+        seqs = ["SEQ1", "SEQ2", "SEQ1"]
+        results = calc_metrics.calculate_metrics(seqs, MagicMock(), "cpu", ["esmpppl", "plddt"])
+
+        self.assertEqual(mock_pppl.call_args[0][0], ["SEQ1", "SEQ2"])
+        self.assertEqual(mock_plddt.call_args[0][0], ["SEQ1", "SEQ2"])
+        self.assertEqual(results["esmpppl"], [10.0, 12.0, 10.0])
+        self.assertEqual(results["plddt"], [0.8, 0.9, 0.8])
+
+    @patch("calc_metrics.plddt.calculate_plddt")
+    def test_calc_metrics_plddt_indices(self, mock_plddt):
+        """Test that deduplicated pLDDT scoring keeps the original sample index for PDB file names."""
+        import calc_metrics
+
+        mock_plddt.return_value = {"SEQ1": 0.8, "SEQ2": 0.9, "SEQ3": 0.7}
+
+        seqs = ["SEQ1", "SEQ1", "SEQ2", "SEQ1", "SEQ3", "SEQ2"]
+        results = calc_metrics.calculate_metrics(seqs, MagicMock(), "cpu", ["plddt"])
+
+        self.assertEqual(mock_plddt.call_args[0][0], ["SEQ1", "SEQ2", "SEQ3"])
+        self.assertEqual(list(mock_plddt.call_args[1]["index_list"]), [0, 2, 4])
+        self.assertEqual(results["plddt"], [0.8, 0.8, 0.9, 0.8, 0.7, 0.9])
+
+    def test_plddt_batched_matches_unbatched(self):
+        """Test that folding in batches gives the same pLDDT values and PDB files as one sequence at a time."""
+        folder = FakeFolder()
+        plddt = load_repo_module(os.path.join("src", "metrics", "plddt.py"), plddt_stubs(folder))
+
+        seqs = ["MKVL", "MK", "", "MKVLAG", "MK", "MKV"]
+        index_list = [10, 11, 12, 13, 14, 15]
+        with tempfile.TemporaryDirectory() as tmp:
+            unbatched_path, batched_path = os.path.join(tmp, "unbatched"), os.path.join(tmp, "batched")
+            unbatched = plddt.calculate_plddt(seqs, index_list, device="cpu", pdb_path=unbatched_path, batch_size=1)
+            self.assertTrue(all(len(batch) == 1 for batch in folder.batches))
+            folder.batches.clear()
+            batched = plddt.calculate_plddt(seqs, index_list, device="cpu", pdb_path=batched_path, batch_size=4)
+            self.assertEqual(max(len(batch) for batch in folder.batches), 4)
+
+            self.assertEqual(batched, unbatched)
+            self.assertEqual(unbatched[""], 0)
+            files = sorted(os.listdir(unbatched_path))
+            self.assertEqual(files, ["00010.pdb", "00011.pdb", "00013.pdb", "00014.pdb", "00015.pdb"])
+            self.assertEqual(sorted(os.listdir(batched_path)), files)
+            for name in files:
+                with open(os.path.join(unbatched_path, name)) as f1, open(os.path.join(batched_path, name)) as f2:
+                    self.assertEqual(f1.read(), f2.read())
+
+    @unittest.skipUnless(HAS_TORCH, "requires torch")
+    def test_int8_quantized_forward_on_cpu(self):
+        """Test that the fp16 ESM language models quantize to INT8 and run a forward pass on CPU."""
+        tokens = torch.tensor([[1, 2, 3]])
+
+        util = load_real_metrics_util(tiny_fp16_lm())
+        _, encoder = util.load_esm_plm("cpu", "esm2", int8=True)
+        self.assertEqual(encoder(tokens).dtype, torch.float32)
+
+        class TinyFold(torch.nn.Module):
+            def __init__(self):
+                super().__init__()
+                self.esm = tiny_fp16_lm()
+
+        plddt = load_repo_module(
+            os.path.join("src", "metrics", "plddt.py"),
+            plddt_stubs(TinyFold(), torch_module=torch, util_module=util),
+        )
+        metric = plddt.ESMMetric("cpu", int8=True)
+        self.assertEqual(metric.model.esm(tokens).shape, (1, 3, 8))
+
+    @unittest.skipUnless(HAS_TORCH and HAS_NUMPY, "requires torch and numpy")
+    def test_mmd_matches_float64_reference(self):
+        """Test that MMD of float32 embeddings matches a float64 NumPy reference."""
+        mmd = load_repo_module(
+            os.path.join("src", "metrics", "mmd.py"), {"torch": torch, "numpy": np, "src.metrics.util": MagicMock()}
+        )
+        rng = np.random.default_rng(0)
+        x = rng.normal(size=(16, 32)).astype(np.float32)
+        y = (rng.normal(size=(16, 32)) + 0.1).astype(np.float32)
+
+        def rbf_sum(a, b):
+            d = ((a[:, None, :] - b[None, :, :]) ** 2).sum(-1)
+            return sum(np.exp(-0.5 * d / bandwidth) for bandwidth in [10, 15, 20, 50])
+
+        x64, y64 = x.astype(np.float64), y.astype(np.float64)
+        expected = np.mean(rbf_sum(x64, x64) + rbf_sum(y64, y64) - 2. * rbf_sum(x64, y64))
+        self.assertAlmostEqual(mmd.calculate_mmd_for_embs(x, y, "cpu"), expected, places=10)
+
+    @unittest.skipUnless(HAS_TORCH and torch.cuda.is_available(), "requires CUDA")
+    def test_cuda_graph_sampling_matches_eager(self):
+        """Test that graph-replayed sampling matches eager pred_embeddings for every allowed solver."""
+        with unmocked_modules():
+            from omegaconf import OmegaConf
+            from src.diffusion.base_trainer import BaseDiffusionTrainer
+            from src.diffusion.dynamic import DynamicSDE
+            from src.diffusion.schedulers import Tanh
+            from src.diffusion.solvers import CUDA_GRAPH_SOLVERS, HeunSolver
+            from src.models.score_estimator import ScoreEstimator
+
+        model_config = OmegaConf.create({
+            "add_cross_attention": False, "attention_head_size": 16, "attention_probs_dropout_prob": 0.1,
+            "embedding_size": 16, "hidden_dropout_prob": 0.1, "hidden_size": 32, "intermediate_size": 64,
+            "layer_norm_eps": 1e-12, "max_position_embeddings": 16, "num_attention_heads": 2,
+            "num_hidden_layers": 2, "qk_norm": False, "use_self_cond": True,
+        })
+        trainer = BaseDiffusionTrainer.__new__(BaseDiffusionTrainer)
+        trainer.device = torch.device("cuda")
+        trainer.config = OmegaConf.create({
+            "model": {"config": model_config},
+            "generation": {"t_min": 0.05, "N_steps": 10, "cuda_graphs": False},
+        })
+        trainer.dynamic = DynamicSDE(Tanh(d=10.0), T=1.0)
+        trainer.score_estimator = ScoreEstimator(model_config).to(trainer.device).eval()
+        attention_mask = torch.ones((2, 8), device=trainer.device)
+        attention_mask[1, 5:] = 0
+
+        def sample(cuda_graphs):
+            trainer.config.generation.cuda_graphs = cuda_graphs
+            torch.manual_seed(0)
+            with torch.inference_mode():
+                return trainer.pred_embeddings(attention_mask)
+
+        for solver_cls in CUDA_GRAPH_SOLVERS:
+            with self.subTest(solver=solver_cls.__name__):
+                trainer.solver = solver_cls(dynamic=trainer.dynamic, score_fn=trainer.calc_score)
+                eager = sample(cuda_graphs=False)
+                replayed = sample(cuda_graphs=True)
+                self.assertTrue(torch.allclose(replayed, eager, atol=1e-5, rtol=1e-4))
+
+        trainer.solver = HeunSolver(dynamic=trainer.dynamic, score_fn=trainer.calc_score)
+        with self.assertRaises(ValueError):
+            sample(cuda_graphs=True)
+
 if __name__ == "__main__":
     unittest.main()
@@ -1,7 +1,8 @@
 import os
+import contextlib
 import torch
 import torch.distributed as dist
-from omegaconf import DictConfig
+from omegaconf import DictConfig, OmegaConf
 from hydra.utils import instantiate
 from datasets import load_from_disk
 from tqdm import trange
@@ -10,6 +11,7 @@ from tqdm import tqdm
 from copy import deepcopy
 
 from src.diffusion.length_sampler import LengthSampler
+from src.diffusion.solvers import CUDA_GRAPH_SOLVERS
 from src.models.ema import ExponentialMovingAverage
 from src.utils.training_utils import get_stat, mse_loss
 from src.utils.logging_utils import log_metric
@@ -59,17 +61,27 @@ class BaseDiffusionTrainer:
 
     def _setup_ddp(self):
         if self.config.ddp.enabled:
+            ddp_config = self.config.ddp
             self.ddp_score_estimator = torch.nn.parallel.DistributedDataParallel(
                 self.score_estimator,
                 device_ids=[dist.get_rank()],
                 broadcast_buffers=False,
-                find_unused_parameters=True,
+                find_unused_parameters=ddp_config.get("find_unused_parameters", True),
+                bucket_cap_mb=ddp_config.get("bucket_cap_mb", 25),
+                gradient_as_bucket_view=ddp_config.get("gradient_as_bucket_view", False),
+                static_graph=ddp_config.get("static_graph", False),
             )
 
     def _setup_train_data_generator(self):
         if not hasattr(self, "train_dataset"):
             self.train_dataset = load_from_disk(os.path.join(self.config.datasets.data_dir, "train"))
 
+        # Reuse the loader between epochs so its persistent workers keep prefetching; only reshuffle
+        if hasattr(self, "train_loader"):
+            if self.sampler_train is not None:
+                self.sampler_train.set_epoch(self.step)
+            return
+
         if self.config.ddp.enabled:
             self.sampler_train = torch.utils.data.DistributedSampler(
                 self.train_dataset,
@@ -79,7 +91,13 @@ class BaseDiffusionTrainer:
         else:
             self.sampler_train = None
         
-        self.train_loader = instantiate(self.config.dataloader, dataset=self.train_dataset, sampler=self.sampler_train)
+        # Only the train loader is reused across epochs, so only its workers are kept alive
+        self.train_loader = instantiate(
+            self.config.dataloader,
+            dataset=self.train_dataset,
+            sampler=self.sampler_train,
+            persistent_workers=self.config.dataloader.num_workers > 0,
+        )
 
     def _setup_valid_data_generator(self):
         if not hasattr(self, "valid_dataset"):
@@ -98,10 +116,8 @@ class BaseDiffusionTrainer:
     def sample_time(self, batch_size: int, eps: float = 1e-5):
         return torch.cuda.FloatTensor(batch_size).uniform_() * (self.dynamic.T - eps) + eps
 
-    def optimizer_step(self, total_loss):   
-        self.optimizer.zero_grad()
-        total_loss.backward()
-
+    def optimizer_step(self):
+        """Clip the accumulated gradients, update the weights, EMA and learning rate."""
         grad_norm = torch.sqrt(sum([torch.sum(t.grad ** 2) for t in self.score_estimator.parameters() if t.requires_grad]))
 
         if self.config.training.grad_clip_norm is not None:
@@ -174,17 +190,30 @@ class BaseDiffusionTrainer:
             self.log_num_parameters()
             self.logger.info(f"Training started with {self.config.training.training_iters} iterations")
 
+        grad_accum_steps = self.config.training.get("grad_accum_steps", 1)
+
         for step in self.train_range:
             self.step = step
 
-            batch = next(self.train_loader_iter, None)
-            if batch is None:
-                self._setup_train_data_generator()
-                self.train_loader_iter = iter(self.train_loader)
+            self.optimizer.zero_grad()
+            for micro_step in range(grad_accum_steps):
                 batch = next(self.train_loader_iter, None)
-            
-            total_loss, loss_dict, stat_dict = self.calc_loss(batch)
-            optimizer_stat_dict = self.optimizer_step(total_loss)
+                if batch is None:
+                    self._setup_train_data_generator()
+                    self.train_loader_iter = iter(self.train_loader)
+                    batch = next(self.train_loader_iter, None)
+
+                # Gradients are all-reduced only on the last micro-batch of the step
+                is_last_micro_step = micro_step == grad_accum_steps - 1
+                if self.config.ddp.enabled and not is_last_micro_step:
+                    sync_context = self.ddp_score_estimator.no_sync()
+                else:
+                    sync_context = contextlib.nullcontext()
+
+                with sync_context:
+                    total_loss, loss_dict, stat_dict = self.calc_loss(batch)
+                    (total_loss / grad_accum_steps).backward()
+            optimizer_stat_dict = self.optimizer_step()
 
             # Logging
             if self.config.ddp.global_rank == 0:
@@ -263,8 +292,8 @@ class BaseDiffusionTrainer:
         self.ddp_score_estimator.eval()
         self.switch_to_ema()
         
-        total_loss = torch.Tensor([0.0])
-        valid_count = torch.Tensor([0.0])
+        # Accumulate on device so no batch forces a host sync; loss and count share one all_reduce
+        valid_stats = torch.zeros(2, device=self.device)
 
         if self.config.ddp.global_rank == 0:
             valid_loader = tqdm(self.valid_loader, desc="Validation")
@@ -274,12 +303,11 @@ class BaseDiffusionTrainer:
         for batch in valid_loader:
             batch_size = len(batch["sequence"])
             batch_loss, _, _ = self.calc_loss(batch)
-            valid_count += batch_size
-            total_loss += batch_loss.item() * batch_size
+            valid_stats[0] += batch_loss.detach() * batch_size
+            valid_stats[1] += batch_size
 
-        valid_count = reduce_tensor(valid_count.cuda())
-        total_loss = reduce_tensor(total_loss.cuda())
-        total_loss = total_loss / valid_count
+        valid_stats = reduce_tensor(valid_stats)
+        total_loss = valid_stats[0] / valid_stats[1]
         if self.config.ddp.global_rank == 0:
             self.log_data({"total_loss": total_loss}, is_train=False)
 
@@ -323,7 +351,7 @@ class BaseDiffusionTrainer:
         if not checkpoint_names:
             return False
 
-        name = self.config.project.checkpoint_name if hasattr(self.config.project, "checkpoint_name") else None
+        name = OmegaConf.select(self.config, "project.checkpoint_name", default=None)
         if not name:
             name = max(checkpoint_names)
         checkpoint_name = f"{prefix_folder}/{name}.pth"
@@ -440,7 +468,7 @@ class BaseDiffusionTrainer:
             file_name = f"{self.step}.json"  
             save_path = os.path.join(prefix_folder, file_name)
             with open(save_path, "w") as f:
-                json.dump(generated_sequences, f, indent=4)
+                f.write(json.dumps(generated_sequences))
             self.logger.info(f"Generated sequences are saved to {save_path}")
 
         # Reference sequences
@@ -456,9 +484,13 @@ class BaseDiffusionTrainer:
 
         # Calculate metrics
         result_metrics = {}
-        for metric_name in self.config.metrics:
-            num_samples = self.config.metrics[metric_name].num_samples
-            max_len = self.config.datasets.max_sequence_len
+        metrics_config = self.config.metrics
+        max_len = self.config.datasets.max_sequence_len
+        rank = self.config.ddp.global_rank
+        world_size = dist.get_world_size()
+        for metric_name in metrics_config:
+            metric_config = metrics_config[metric_name]
+            num_samples = metric_config.num_samples
             self.logger.info(f"Calculating {metric_name} for {num_samples} texts")
             
             tmp_result = compute_ddp_metric(
@@ -467,9 +499,10 @@ class BaseDiffusionTrainer:
                 references=reference_sequences[:num_samples],
                 max_len = max_len,
                 device = self.device,
-                rank = self.config.ddp.global_rank,
-                world_size = dist.get_world_size(),
-                pdb_path = self.config.metrics[metric_name].pdb_path if "plddt" in metric_name else None
+                rank = rank,
+                world_size = world_size,
+                pdb_path = metric_config.pdb_path if "plddt" in metric_name else None,
+                plddt_batch_size = metric_config.get("batch_size", 1) if "plddt" in metric_name else 1,
             )
             result_metrics[metric_name] = tmp_result
         
@@ -492,7 +525,7 @@ class BaseDiffusionTrainer:
             # Generate text batch
             lens = self.length_sampler.sample(batch_size)
             attention_mask = self.encoder.get_attention_mask_for_lens(lens, max_sequence_len=self.config.datasets.max_sequence_len)
-            with torch.no_grad():
+            with torch.inference_mode():
                 pred_embeddings = self.pred_embeddings(attention_mask)
                 sequences = self.pred_logits(pred_embeddings, attention_mask=attention_mask)
 
@@ -512,6 +545,14 @@ class BaseDiffusionTrainer:
         eps_t = self.config.generation.t_min
         
         timesteps = torch.linspace(self.dynamic.T, eps_t, self.config.generation.N_steps + 1, device=self.device)
+        if self.config.generation.get("cuda_graphs", False) and self.device.type == "cuda":
+            if not isinstance(self.solver, CUDA_GRAPH_SOLVERS):
+                raise ValueError(
+                    f"generation.cuda_graphs is not supported with {type(self.solver).__name__}: its step synchronizes with the host. "
+                    f"Supported solvers: {', '.join(solver.__name__ for solver in CUDA_GRAPH_SOLVERS)}"
+                )
+            return self.pred_embeddings_cuda_graph(x, x_0_self_cond, attention_mask, timesteps)
+
         for idx in tqdm(range(self.config.generation.N_steps)):
             t = timesteps[idx]
             next_t = timesteps[idx + 1]
@@ -528,6 +569,48 @@ class BaseDiffusionTrainer:
             x_0_self_cond = output["x_0"]
         return x_mean
 
+    def pred_embeddings_cuda_graph(self, x: torch.Tensor, x_0_self_cond: torch.Tensor, attention_mask: torch.Tensor, timesteps: torch.Tensor):
+        """
+        Same sampling loop as pred_embeddings, but one solver step is captured as a CUDA graph
+        and replayed for every timestep, since all shapes are fixed within a batch.
+        Requires a solver step without host synchronization (Euler, DDIM, DDPM).
+        The RNG state is rewound after capture, so replays draw the same noise as eager sampling.
+        """
+        static_x = x.clone()
+        static_x_0_self_cond = x_0_self_cond.clone()
+        static_t = torch.full((x.shape[0],), timesteps[0].item(), device=self.device)
+        static_next_t = torch.full((x.shape[0],), timesteps[1].item(), device=self.device)
+
+        def step():
+            return self.solver.step(
+                x_t=static_x, t=static_t, next_t=static_next_t,
+                mask=attention_mask,
+                x_0_self_cond=static_x_0_self_cond,
+            )
+
+        rng_state = torch.cuda.get_rng_state(self.device)
+
+        # Warm up on a side stream before capture, as required by torch.cuda.graph
+        stream = torch.cuda.Stream()
+        stream.wait_stream(torch.cuda.current_stream())
+        with torch.cuda.stream(stream):
+            for _ in range(3):
+                step()
+        torch.cuda.current_stream().wait_stream(stream)
+
+        graph = torch.cuda.CUDAGraph()
+        with torch.cuda.graph(graph):
+            static_output = step()
+        torch.cuda.set_rng_state(rng_state, self.device)
+
+        for idx in tqdm(range(self.config.generation.N_steps)):
+            static_t.fill_(timesteps[idx])
+            static_next_t.fill_(timesteps[idx + 1])
+            graph.replay()
+            static_x.copy_(static_output["x"])
+            static_x_0_self_cond.copy_(static_output["x_0"])
+        return static_output["x_mean"].clone()
+
     def pred_logits(self, pred_embeddings: torch.Tensor, attention_mask: torch.Tensor):
         return self.encoder.batch_decode(encodings=pred_embeddings, attention_mask=attention_mask)
     
@@ -161,3 +161,8 @@ class DDPMSolver:
             "x_mean": mu,
             "x_0": x_0,
         }
+
+
+# Solvers whose step (including the score estimator forward) captures into a CUDA graph, as checked
+# against eager sampling in auto-scripts/tests. Heun and EDM branch on next_t[0] on the host.
+CUDA_GRAPH_SOLVERS = (EulerDiffEqSolver, DDIMSolver, DDPMSolver)
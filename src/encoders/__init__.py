@@ -1,6 +1,22 @@
+import importlib
+
 from src.encoders.base import Encoder
-from src.encoders.esm2 import ESM2EncoderModel
-from src.encoders.saprot import SaprotEncoderModel
-# from src.encoders.esmc import ESMCEncoderModel
-from src.encoders.cheap import CHEAPEncoderModel
 from src.encoders.enc_normalizer import EncNormalizer
+
+# Encoder models pull in transformers / cheap, so they are only imported on first access
+_LAZY_ENCODERS = {
+    "ESM2EncoderModel": "src.encoders.esm2",
+    "SaprotEncoderModel": "src.encoders.saprot",
+    # "ESMCEncoderModel": "src.encoders.esmc",
+    "CHEAPEncoderModel": "src.encoders.cheap",
+}
+
+__all__ = ["Encoder", "EncNormalizer", *_LAZY_ENCODERS]
+
+
+def __getattr__(name):
+    if name in _LAZY_ENCODERS:
+        value = getattr(importlib.import_module(_LAZY_ENCODERS[name]), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
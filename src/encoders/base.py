@@ -1,4 +1,6 @@
 import os
+import pickle
+import functools
 import torch
 import torch.nn as nn
 from omegaconf import DictConfig
@@ -6,6 +8,30 @@ from typing import List, Optional, Tuple, Dict
 
 from src.encoders.enc_normalizer import EncNormalizer
 
+# Tokenizers join decoded tokens with spaces; deleting whitespace via translate is a single C pass
+WHITESPACE_TABLE = str.maketrans("", "", " \t\n\r\x0b\x0c")
+
+
+@functools.lru_cache(maxsize=4)
+def _load_decoder_state(decoder_path: str, mtime: float) -> Dict[str, torch.Tensor]:
+    # Decoder checkpoints from train_decoder.py hold only tensors, so map storages from the file instead of copying them.
+    # Legacy (non-zipfile) checkpoints cannot be mmapped (RuntimeError), and downloaded ones may pickle
+    # other objects (UnpicklingError under weights_only); both go through a plain load
+    try:
+        checkpoint = torch.load(decoder_path, map_location="cpu", mmap=True, weights_only=True)
+    except (RuntimeError, pickle.UnpicklingError):
+        checkpoint = torch.load(decoder_path, map_location="cpu")
+    return checkpoint["decoder"]
+
+
+def load_decoder_state(decoder_path: str) -> Optional[Dict[str, torch.Tensor]]:
+    """Decoder state_dict from a checkpoint, reused while the file is unchanged (it is loaded at init and again on restore).
+    Returns None if there is no checkpoint at decoder_path."""
+    try:
+        return _load_decoder_state(decoder_path, os.path.getmtime(decoder_path))
+    except (FileNotFoundError, IsADirectoryError):
+        return None
+
 
 class Encoder(nn.Module):
     """
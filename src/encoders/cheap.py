@@ -25,8 +25,10 @@ class CHEAPEncoderModel(Encoder):
             add_enc_normalizer=add_enc_normalizer,
         )
         
-        self.shorten_factor = int(self.config.encoder_type.split("_")[2])
-        self.channel_dimension = int(self.config.encoder_type.split("_")[4])
+        # encoder_type has the form CHEAP_shorten_{shorten_factor}_dim_{channel_dimension}
+        encoder_type_parts = self.config.encoder_type.split("_")
+        self.shorten_factor = int(encoder_type_parts[2])
+        self.channel_dimension = int(encoder_type_parts[4])
         
         self.tokenizer = DecoderTokenizer()
         
@@ -68,7 +70,8 @@ class CHEAPEncoderModel(Encoder):
             return_logits=True
         )
         
-        sequence = [s[:int(m.sum().item() * self.shorten_factor)] for s, m in zip(sequence, attention_mask)]
+        seq_lens = attention_mask.sum(dim=1).tolist()
+        sequence = [s[:int(l * self.shorten_factor)] for s, l in zip(sequence, seq_lens)]
         return sequence
 
     def get_attention_mask_for_lens(self, lens: List[int], max_sequence_len: int) -> torch.Tensor:
@@ -97,7 +100,8 @@ class CHEAPEncoderModel(Encoder):
             return_logits=True
         )
         
-        sequence = [s[:int(m.sum().item() * self.shorten_factor)] for s, m in zip(sequence, attention_mask)]
+        seq_lens = attention_mask.sum(dim=1).tolist()
+        sequence = [s[:int(l * self.shorten_factor)] for s, l in zip(sequence, seq_lens)]
         return esm_encodings, sequence
     
     def get_esm_encodings(self, sequences):
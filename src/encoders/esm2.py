@@ -1,4 +1,3 @@
-import os
 import torch
 from transformers import EsmTokenizer, EsmForMaskedLM
 from typing import Optional, Dict, List
@@ -6,7 +5,7 @@ from omegaconf import DictConfig
 from hydra.utils import instantiate
 
 from src.encoders.transformer_decoder import TransformerDecoder
-from src.encoders.base import Encoder
+from src.encoders.base import Encoder, WHITESPACE_TABLE, load_decoder_state
 
 
 class ESM2EncoderModel(Encoder):
@@ -39,8 +38,9 @@ class ESM2EncoderModel(Encoder):
             self.sequence_decoder = TransformerDecoder(
                 config=self.main_config
             )
-            if decoder_path is not None and os.path.exists(decoder_path):
-                self.sequence_decoder.load_state_dict(torch.load(decoder_path)["decoder"])
+            decoder_state = load_decoder_state(decoder_path) if decoder_path is not None else None
+            if decoder_state is not None:
+                self.sequence_decoder.load_state_dict(decoder_state)
             else:
                 print("Decoder wasn't initialized")
         else:
@@ -75,14 +75,15 @@ class ESM2EncoderModel(Encoder):
         encodings = self.enc_normalizer.denormalize(encodings)
         logits = self.sequence_decoder(x=encodings, mask=attention_mask)
 
-        token_ids = logits.argmax(axis=-1).detach().cpu().tolist()
+        # Vocabularies are small, so narrow the ids before the device-to-host copy
+        ids_dtype = torch.int16 if logits.shape[-1] < 32768 else torch.int32
+        token_ids = logits.argmax(axis=-1).to(ids_dtype).cpu().tolist()
         if attention_mask is not None:
-            for i, t in enumerate(token_ids):
-                seq_len = int(attention_mask[i].sum().item())
-                token_ids[i] = t[:seq_len]
+            seq_lens = attention_mask.sum(dim=1).int().tolist()
+            token_ids = [t[:seq_len] for t, seq_len in zip(token_ids, seq_lens)]
 
         token_ids = self.tokenizer.batch_decode(token_ids, skip_special_tokens=True)
-        decoded_sequences = [''.join(t.split()) for t in token_ids]
+        decoded_sequences = [t.translate(WHITESPACE_TABLE) for t in token_ids]
         return decoded_sequences  
         
 
@@ -96,7 +97,8 @@ class ESM2EncoderModel(Encoder):
         return logits
 
     def restore_decoder(self, decoder_path: str):
-        if os.path.exists(decoder_path):
-            self.sequence_decoder.load_state_dict(torch.load(decoder_path)["decoder"])
+        decoder_state = load_decoder_state(decoder_path)
+        if decoder_state is not None:
+            self.sequence_decoder.load_state_dict(decoder_state)
         else:
             print(f"Warning: Decoder checkpoint path provided, but no decoder is present in the model.")
\ No newline at end of file
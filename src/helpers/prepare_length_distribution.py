@@ -1,21 +1,20 @@
 import argparse
 from datasets import load_from_disk
 import numpy as np
+import pyarrow.compute as pc
 
 from src.utils.hydra_utils import setup_config
 
 
 def main(config):
-    dataset = load_from_disk(config.datasets.data_dir)["train"]["sequence"]
-    lengths = [len(seq) for seq in dataset]
-    quantity = np.zeros(max(lengths) + 1)
-    for length in lengths:
-        quantity[length] += 1
-    quantity = quantity / len(lengths)
+    dataset = load_from_disk(config.datasets.data_dir)["train"]
+    # Lengths are computed on the Arrow column, without materializing the sequences as Python strings
+    lengths = pc.utf8_length(dataset.with_format("arrow")["sequence"]).to_numpy()
+    quantity = np.bincount(lengths) / len(lengths)
     np.save(config.datasets.length_distribution, quantity)
     print(f"Length distribution saved to {config.datasets.length_distribution}")
-    print(f"Max length: {max(lengths)}")
-    print(f"Min length: {min(lengths)}")
+    print(f"Max length: {lengths.max()}")
+    print(f"Min length: {lengths.min()}")
 
 
 if __name__ == "__main__":
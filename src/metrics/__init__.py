@@ -1,6 +1,20 @@
+import importlib
+
 from src.metrics.metric import compute_ddp_metric
-from src.metrics.fid import calculate_fid_for_lists
-from src.metrics.plddt import calculate_plddt
-from src.metrics.esmpppl import calculate_pppl
+
+# Metric implementations load heavy model code (cheap.esmfold, scipy, transformers), so import them on first access
+_LAZY_FUNCTIONS = {
+    "calculate_fid_for_lists": "src.metrics.fid",
+    "calculate_plddt": "src.metrics.plddt",
+    "calculate_pppl": "src.metrics.esmpppl",
+}
 
 __all__ = ["compute_ddp_metric", "calculate_fid_for_lists", "calculate_plddt", "calculate_pppl"]
+
+
+def __getattr__(name):
+    if name in _LAZY_FUNCTIONS:
+        value = getattr(importlib.import_module(_LAZY_FUNCTIONS[name]), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
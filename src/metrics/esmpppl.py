@@ -23,7 +23,28 @@ def get_model_name(model_key):
         raise ValueError(f"Unknown model key: {model_key}")
 
 
-def compute_pseudo_prob_batch(sequences, encoder, tokenizer, device, max_len):
+def capture_cuda_graph(fn, example_input, warmup_steps=3):
+    """Capture fn(example_input) in a CUDA graph; the returned function copies its input into the static buffer and replays."""
+    static_input = example_input.clone()
+    stream = torch.cuda.Stream()
+    stream.wait_stream(torch.cuda.current_stream())
+    with torch.cuda.stream(stream):
+        for _ in range(warmup_steps):
+            fn(static_input)
+    torch.cuda.current_stream().wait_stream(stream)
+
+    graph = torch.cuda.CUDAGraph()
+    with torch.cuda.graph(graph):
+        static_output = fn(static_input)
+
+    def replay(x):
+        static_input.copy_(x)
+        graph.replay()
+        return static_output
+    return replay
+
+
+def compute_pseudo_prob_batch(sequences, encoder, tokenizer, device, max_len, cuda_graphs=False):
     tokenized_X = tokenizer.batch_encode_plus(
         sequences, 
         add_special_tokens=True, 
@@ -35,22 +56,31 @@ def compute_pseudo_prob_batch(sequences, encoder, tokenizer, device, max_len):
     input_ids = tokenized_X['input_ids'].to(device) # [batch_size, max_len]
     attention_mask = tokenized_X['attention_mask'].to(device) # [batch_size, max_len]
 
-    batch_token_probs = torch.zeros(input_ids.shape).to(device) 
+    batch_token_probs = torch.zeros(input_ids.shape, device=device)
+
+    # Every masked position runs a forward with the same shapes, so the batch can replay one captured graph
+    use_graph = cuda_graphs and input_ids.is_cuda
+
+    def forward(masked_input_ids):
+        with torch.no_grad(), torch.autocast(device_type='cuda', dtype=torch.float16, cache_enabled=not use_graph):
+            return encoder(input_ids=masked_input_ids, attention_mask=attention_mask).logits
+
+    if use_graph:
+        forward = capture_cuda_graph(forward, input_ids)
 
     for token_idx in range(input_ids.shape[1]):
         masked_input_ids = input_ids.clone()
         masked_input_ids[:, token_idx] = tokenizer.mask_token_id
 
-        with torch.no_grad(), torch.autocast(device_type='cuda', dtype=torch.float16):
-            outputs = encoder(input_ids=masked_input_ids, attention_mask=attention_mask)
-            logits = outputs.logits # [batch_size, max_len + 2, vocab_size (33)]
-            log_likelihood = torch.nn.functional.log_softmax(logits[:, token_idx, :], dim=-1) # [batch_size, vocab_size (33)]
+        with torch.no_grad():
+            logits = forward(masked_input_ids) # [batch_size, max_len + 2, vocab_size (33)]
+            log_likelihood = torch.nn.functional.log_softmax(logits[:, token_idx, :].float(), dim=-1) # [batch_size, vocab_size (33)]
             neg_log_likelihood = -1 * log_likelihood
 
         token_probabilities = torch.gather(neg_log_likelihood, -1, input_ids[:, token_idx].unsqueeze(-1)).squeeze(-1) # [batch_size]
         batch_token_probs[:, token_idx] = token_probabilities
 
-    all_special_ids = torch.tensor(tokenizer.all_special_ids).to(device)
+    all_special_ids = torch.tensor(tokenizer.all_special_ids, device=device)
     expanded_input_ids = input_ids.unsqueeze(-1)
     matches = expanded_input_ids == all_special_ids
     non_special_mask = ~matches.any(dim=-1)
@@ -62,13 +92,21 @@ def compute_pseudo_prob_batch(sequences, encoder, tokenizer, device, max_len):
     return pppl.tolist()
 
 
-def calculate_pppl(predictions: List[str], max_len: int, device: str = "cuda:0") -> List[float]:
+def calculate_pppl(predictions: List[str], max_len: int, device: str = "cuda:0", int8: bool = False, cuda_graphs: bool = False) -> List[float]:
     batch_size = 64
+    # Parsed once here instead of on every per-batch tensor allocation and copy
+    device = torch.device(device)
     model_name = get_model_name("ESM2_650M")
-    tokenizer, encoder = load_esm_plm(device, model_name)
+    tokenizer, encoder = load_esm_plm(device, model_name, int8=int8)
+
+    # Batch sequences of similar length together: every padded position costs a full forward pass
+    order = sorted(range(len(predictions)), key=lambda i: len(predictions[i]))
 
-    dataset_pppl = []
-    for i in tqdm(range(0, len(predictions), batch_size)):
-        batch_pppl = compute_pseudo_prob_batch(predictions[i:i + batch_size], encoder, tokenizer, device, max_len)
-        dataset_pppl.extend(batch_pppl)
+    dataset_pppl = [0.0] * len(predictions)
+    for i in tqdm(range(0, len(order), batch_size)):
+        batch_indices = order[i:i + batch_size]
+        batch = [predictions[j] for j in batch_indices]
+        batch_pppl = compute_pseudo_prob_batch(batch, encoder, tokenizer, device, max_len, cuda_graphs=cuda_graphs)
+        for j, value in zip(batch_indices, batch_pppl):
+            dataset_pppl[j] = value
     return dataset_pppl
\ No newline at end of file
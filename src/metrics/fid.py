@@ -7,8 +7,8 @@ from src.metrics.util import create_embeds
 
 def calculate_activation_statistics(batch):
     act = batch # (B, Dim) (2048, 1024)
-    mu = np.mean(act, axis=0)
-    sigma = np.cov(act, rowvar=False)
+    mu = np.mean(act, axis=0, dtype=np.float64)
+    sigma = np.cov(act, rowvar=False, dtype=np.float64)
     return mu, sigma
 
 
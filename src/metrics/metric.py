@@ -1,45 +1,57 @@
 
+import math
 import torch
-import numpy as np
 from typing import Optional, List
 
-from src.metrics.plddt import calculate_plddt
-from src.metrics.fid import calculate_fid_for_lists
-from src.metrics.mmd import calculate_mmd_for_lists
-from src.metrics.esmpppl import calculate_pppl
 from src.utils.ddp_utils import reduce_tensor
 
+# Metrics that are computed per sample on a shard of the predictions and then averaged across ranks
+PER_SAMPLE_METRICS = frozenset(["plddt", "esm_pppl"])
+
 
 def compute_ddp_metric(metric_name: str, predictions: List[str], references: List[str], 
-                       max_len: int, device: str, rank: int = 0, world_size: int = 1, pdb_path: str = "") -> float:
-    if metric_name in ["plddt", "esm_pppl"]:
+                       max_len: int, device: str, rank: int = 0, world_size: int = 1, pdb_path: str = "",
+                       plddt_batch_size: int = 1) -> float:
+    if metric_name in PER_SAMPLE_METRICS:
         # Split predictions and references across GPUs
         num_samples = len(predictions) // world_size
         if rank < len(predictions) % world_size:
             num_samples += 1
         predictions = predictions[rank * num_samples: (rank + 1) * num_samples]
         references = references[rank * num_samples: (rank + 1) * num_samples]
-        index_list = list(range(rank * num_samples, (rank + 1) * num_samples))
+        index_list = range(rank * num_samples, (rank + 1) * num_samples)
 
+    # Each metric module pulls in its own model stack (ESMFold, ProtT5, ESM-2), so import only the requested one
     if metric_name == "plddt":  
+        from src.metrics.plddt import calculate_plddt
         print(f"Calculating plddt for {len(predictions)} texts")  
-        plddt_result = calculate_plddt(predictions=predictions, index_list=index_list, device=device, pdb_path=pdb_path)
-        value = np.mean(list(plddt_result.values()))
+        plddt_result = calculate_plddt(
+            predictions=predictions, index_list=index_list, device=device, pdb_path=pdb_path, batch_size=plddt_batch_size
+        )
+        value_sum, count = math.fsum(plddt_result.values()), len(plddt_result)
 
-    if metric_name == "fid":
+    elif metric_name == "fid":
+        from src.metrics.fid import calculate_fid_for_lists
         value = calculate_fid_for_lists(predictions=predictions, references=references, max_len=max_len, device=device)
 
-    if metric_name == "mmd":
+    elif metric_name == "mmd":
+        from src.metrics.mmd import calculate_mmd_for_lists
         value = calculate_mmd_for_lists(predictions=predictions, references=references, max_len=max_len, device=device)
 
-    if metric_name == "esm_pppl":
+    elif metric_name == "esm_pppl":
+        from src.metrics.esmpppl import calculate_pppl
         print(f"Calculating esm_pppl for {len(predictions)} texts")
         pppl_result = calculate_pppl(predictions=predictions, max_len=max_len, device=device)
-        value = np.mean(pppl_result)
+        value_sum, count = math.fsum(pppl_result), len(pppl_result)
+
+    else:
+        raise ValueError(f"Unknown metric {metric_name}")
 
-    if metric_name in ["plddt", "esm_pppl"]:
-        value = torch.tensor([value], device=device)
-        value = reduce_tensor(value)
-        value = value.item()
+    if metric_name in PER_SAMPLE_METRICS:
+        # Reduce the sum and the count rather than a per-rank mean: a rank with an empty shard
+        # contributes zeros to the all_reduce instead of failing before it and hanging the others
+        stats = torch.tensor([value_sum, count], device=device, dtype=torch.float64)
+        stats = reduce_tensor(stats)
+        value = (stats[0] / stats[1]).item()
 
     return value
\ No newline at end of file
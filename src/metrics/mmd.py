@@ -22,9 +22,9 @@ def emp_MMD(x, y, kernel, device):
     dyy = ry.t() + ry - 2. * yy # Used for B in (1)
     dxy = rx.t() + ry - 2. * zz # Used for C in (1)
 
-    XX, YY, XY = (torch.zeros(xx.shape).to(device),
-                  torch.zeros(xx.shape).to(device),
-                  torch.zeros(xx.shape).to(device))
+    XX, YY, XY = (torch.zeros(xx.shape, device=device, dtype=torch.float64),
+                  torch.zeros(xx.shape, device=device, dtype=torch.float64),
+                  torch.zeros(xx.shape, device=device, dtype=torch.float64))
 
     if kernel == "multiscale":
         bandwidth_range = [0.2, 0.5, 0.9, 1.3]
@@ -44,9 +44,10 @@ def emp_MMD(x, y, kernel, device):
 
 
 def calculate_mmd_for_embs(embeddings_1, embeddings_2, device):
+    # Embeddings are stored in float32; the pairwise distances cancel badly, so MMD is computed in float64
     mmd = emp_MMD(
-        torch.tensor(embeddings_1).to(device), 
-        torch.tensor(embeddings_2).to(device),
+        torch.as_tensor(embeddings_1, device=device, dtype=torch.float64),
+        torch.as_tensor(embeddings_2, device=device, dtype=torch.float64),
         'rbf',
         device
     ).item()
@@ -1,40 +1,70 @@
+import io
 import os
 import torch
-import biotite.structure.io as bsio
-from typing import List, Dict
+import biotite.structure.io.pdb as pdb
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Sequence
 from tqdm import tqdm
 
 from cheap.esmfold import esmfold_v1
 
+from src.metrics.util import quantize_int8
+
+
+def write_pdb(file_path: str, pdb_text: str) -> None:
+    with open(file_path, "w") as f:
+        f.write(pdb_text)
+
 
 class ESMMetric:
-    def __init__(self, device: str = "cpu"):
+    def __init__(self, device: str = "cpu", int8: bool = False):
         self.model = esmfold_v1()
-        self.model = self.model.eval().to(device)
+        self.model = self.model.eval()
+        if int8:
+            # The ESM-2 language model dominates the folding cost; the folding trunk stays in full precision
+            self.model.esm = quantize_int8(self.model.esm, device)
+        self.model = self.model.to(device)
         self.device = device
 
     @torch.no_grad()
-    def __call__(self, protein: str, index: int, pdb_path: str) -> float:
+    def __call__(self, protein: str, index: int, pdb_path: str, write_fn=write_pdb) -> float:
         if not protein:
             return 0
-        output = self.model.infer_pdb(protein)
+        return self.fold_batch([protein], [index], pdb_path, write_fn=write_fn)[0]
+
+    @torch.no_grad()
+    def fold_batch(self, proteins: List[str], indices: List[int], pdb_path: str, write_fn=write_pdb) -> List[float]:
+        outputs = self.model.infer_pdbs(proteins)
 
         os.makedirs(pdb_path, exist_ok=True)
-        file_path = os.path.join(pdb_path, f"{index:05d}.pdb")
+        plddts = []
+        for index, output in zip(indices, outputs):
+            file_path = os.path.join(pdb_path, f"{index:05d}.pdb")
 
-        with open(file_path, "w") as f:
-            f.write(output)
-        struct = bsio.load_structure(file_path, extra_fields=["b_factor"])
-        return struct.b_factor.mean()
+            # pLDDT is read from the in-memory PDB text, so write_fn may write the file asynchronously
+            write_fn(file_path, output)
+            struct = pdb.PDBFile.read(io.StringIO(output)).get_structure(model=1, extra_fields=["b_factor"])
+            plddts.append(struct.b_factor.mean())
+        return plddts
 
 
-def calculate_plddt(predictions: List[str], index_list: List[int], device="cuda", pdb_path="") -> Dict[str, float]:
-    metric_fn = ESMMetric(device)
+def calculate_plddt(predictions: List[str], index_list: Sequence[int], device="cuda", pdb_path="", int8=False, batch_size=1) -> Dict[str, float]:
+    metric_fn = ESMMetric(device, int8=int8)
 
     os.makedirs(pdb_path, exist_ok=True)
 
-    result = dict()
-    for i, protein in tqdm(enumerate(predictions)):
-        ind = index_list[i]
-        result[protein] = metric_fn(protein=protein, index=ind, pdb_path=pdb_path)
-    return result
\ No newline at end of file
+    result = {protein: 0 for protein in predictions if not protein}
+    # Fold proteins of similar length together so each batch carries little padding
+    order = sorted((i for i, protein in enumerate(predictions) if protein), key=lambda i: len(predictions[i]))
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        # Write PDB files in the background while the next batch is being folded
+        writes = []
+        write_fn = lambda file_path, pdb_text: writes.append(pool.submit(write_pdb, file_path, pdb_text))
+        for start in tqdm(range(0, len(order), batch_size)):
+            batch_indices = order[start:start + batch_size]
+            proteins = [predictions[i] for i in batch_indices]
+            plddts = metric_fn.fold_batch(proteins, [index_list[i] for i in batch_indices], pdb_path, write_fn=write_fn)
+            result.update(zip(proteins, plddts))
+        for future in writes:
+            future.result()
+    return result
@@ -13,10 +13,22 @@ def load_t5_plm(device):
     return tokenizer, encoder
 
 
-def load_esm_plm(device, model_name):
+def quantize_int8(model, device):
+    """Dynamic INT8 quantization of linear layers. Quantized kernels run on CPU only."""
+    if torch.device(device).type != "cpu":
+        raise ValueError(f"INT8 quantization is only supported on CPU, got device {device}")
+    # Dynamic quantization needs float32 weights and activations; ESMFold ships its language model in fp16
+    model = model.float()
+    return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def load_esm_plm(device, model_name, int8=False):
     tokenizer = EsmTokenizer.from_pretrained(model_name)
-    encoder = EsmForMaskedLM.from_pretrained(model_name, add_cross_attention=False, is_decoder=False).to(device)
+    encoder = EsmForMaskedLM.from_pretrained(model_name, add_cross_attention=False, is_decoder=False)
     encoder.eval()
+    if int8:
+        encoder = quantize_int8(encoder, device)
+    encoder = encoder.to(device)
     return tokenizer, encoder
 
 
@@ -32,7 +44,8 @@ def create_t5_embeds(encoder, tokenizer, raw_seq_list, device, max_len, batch_si
     else:
         inputs = tokenizer(seq_list, return_tensors="pt", padding=True).to(device)
 
-    embeddings = np.zeros((len(seq_list), 1024))
+    # ProtT5 runs in half precision, so float32 features are lossless; FID statistics are accumulated in float64
+    embeddings = np.zeros((len(seq_list), 1024), dtype=np.float32)
     for i in range(0, inputs.input_ids.shape[0], batch_size):
         batch = {key: inputs[key][i:i+batch_size, :].to(device) for key in inputs.keys()}
         
@@ -46,7 +59,16 @@ def create_t5_embeds(encoder, tokenizer, raw_seq_list, device, max_len, batch_si
     return embeddings
 
 
+# FID and MMD are computed back to back on the same predictions and references; keep the last embeddings
+_EMBEDS_CACHE = {}
+
+
 def create_embeds(seq_list_1, seq_list_2, max_len, device="cuda:0"):
+    key = (tuple(seq_list_1), tuple(seq_list_2), max_len, str(device))
+    if key in _EMBEDS_CACHE:
+        return _EMBEDS_CACHE[key]
+
+    device = torch.device(device)
     tokenizer, encoder = load_t5_plm(device)
     embeddings_1 = create_t5_embeds(
         encoder, 
@@ -62,4 +84,6 @@ def create_embeds(seq_list_1, seq_list_2, max_len, device="cuda:0"):
         device, 
         max_len=max_len,
     )
+    _EMBEDS_CACHE.clear()
+    _EMBEDS_CACHE[key] = (embeddings_1, embeddings_2)
     return embeddings_1, embeddings_2
\ No newline at end of file